@@ -243,14 +243,14 @@ class Device(object):
                 hidapi.hid_read_timeout, self._dev, self.buf, size, timeout
             )
 
-        return self.buf.raw[:size]
+        return ctypes.string_at(self.buf, size)
 
     def get_input_report(self, report_id, size: int = MAX_REPORT_SIZE):
         # Pass the id of the report to be read.
         self.buf[0] = bytearray((report_id,))
 
         size = self.__hidcall(hidapi.hid_get_input_report, self._dev, self.buf, size)
-        return self.buf.raw[:size]
+        return ctypes.string_at(self.buf, size)
 
     def send_feature_report(self, data):
         return self.__hidcall(
@@ -262,7 +262,7 @@ class Device(object):
         self.buf[0] = bytearray((report_id,))
 
         size = self.__hidcall(hidapi.hid_get_feature_report, self._dev, self.buf, size)
-        return self.buf.raw[:size]
+        return ctypes.string_at(self.buf, size)
 
     def close(self):
         if self._dev:
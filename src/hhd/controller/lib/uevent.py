@@ -0,0 +1,100 @@
+import errno
+import logging
+import select
+import socket
+import time
+from threading import Event as TEvent
+from typing import Sequence
+
+logger = logging.getLogger(__name__)
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 16384
+# Longest time to block before checking if the caller should exit
+EXIT_CHECK_DELAY = 0.5
+
+
+class UeventMonitor:
+    """Listens to kernel uevents so that device plugins can block until a
+    device is added instead of polling for it.
+
+    If the netlink socket can not be opened, `wait()` falls back to sleeping."""
+
+    def __init__(
+        self, subsystems: Sequence[str] = ("input",), settle: float = 0.1
+    ) -> None:
+        self.subsystems = frozenset(s.encode() for s in subsystems)
+        self.settle = settle
+        self.sock = None
+
+    def open(self) -> bool:
+        try:
+            self.sock = socket.socket(
+                socket.AF_NETLINK,
+                socket.SOCK_DGRAM | socket.SOCK_NONBLOCK,
+                NETLINK_KOBJECT_UEVENT,
+            )
+            self.sock.bind((0, UEVENT_KERNEL_GROUP))
+            return True
+        except Exception as e:
+            logger.warning(f"Could not listen to uevents, polling instead:\n{e}")
+            self.close()
+            return False
+
+    def _added(self) -> bool:
+        assert self.sock
+        found = False
+        while True:
+            try:
+                data = self.sock.recv(UEVENT_BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return found
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # Buffer overrun, events were dropped so check anyway
+                found = True
+                continue
+
+            action = None
+            subsystem = None
+            for line in data.split(b"\0"):
+                if line.startswith(b"ACTION="):
+                    action = line[7:]
+                elif line.startswith(b"SUBSYSTEM="):
+                    subsystem = line[10:]
+            if action == b"add" and subsystem in self.subsystems:
+                found = True
+
+    def wait(self, timeout: float, should_exit: TEvent | None = None) -> bool:
+        """Waits up to `timeout` for a device to be added. Returns true if one was.
+
+        If `should_exit` is provided, returns early once it is set."""
+        if not self.sock:
+            if should_exit:
+                should_exit.wait(timeout)
+            else:
+                time.sleep(timeout)
+            return False
+
+        end = time.perf_counter() + timeout
+        while (left := end - time.perf_counter()) > 0:
+            if should_exit and should_exit.is_set():
+                break
+            if not select.select(
+                [self.sock], [], [], min(left, EXIT_CHECK_DELAY)
+            )[0]:
+                continue
+            if self._added():
+                # The kernel sends the uevent before the device is fully
+                # registered, so give it a bit of time.
+                time.sleep(self.settle)
+                self._added()
+                return True
+        return False
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
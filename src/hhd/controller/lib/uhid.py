@@ -16,6 +16,8 @@ from hhd.controller import can_read
 
 # _HID_MAX_DESCRIPTOR_SIZE = 4096
 UHID_DATA_MAX = 4096
+# u32 type, u16 size
+UHID_INPUT2_HEADER_SIZE = 6
 
 
 BUS_PCI = 0x01
@@ -221,6 +223,7 @@ class UhidDevice:
 
         self.fd = 0
         self.poll = None
+        self._input_buf = bytearray(UHID_INPUT2_HEADER_SIZE + UHID_DATA_MAX)
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}(vid={self.vid}, pid={self.pid}, name={self.name}, uniq={self.unique_name})"
@@ -234,7 +237,7 @@ class UhidDevice:
             os.close(self.fd)
             self.fd = 0
 
-    def send_event(self, event: bytes):
+    def send_event(self, event: bytes | memoryview):
         if not self.fd:
             self.fd = os.open("/dev/uhid", os.O_RDWR)
         os.write(self.fd, event)
@@ -303,8 +306,12 @@ class UhidDevice:
         self.send_event(int.to_bytes(UHID_DESTROY, 4, byteorder=sys.byteorder))
 
     def send_input_report(self, data: bytes):
-        ev = struct.pack("< L H", UHID_INPUT2, len(data)) + data
-        self.send_event(ev)
+        # The event has to be written at once, so writev can not be used
+        size = len(data)
+        buf = self._input_buf
+        struct.pack_into("< L H", buf, 0, UHID_INPUT2, size)
+        buf[UHID_INPUT2_HEADER_SIZE : UHID_INPUT2_HEADER_SIZE + size] = data
+        self.send_event(memoryview(buf)[: UHID_INPUT2_HEADER_SIZE + size])
 
     def send_get_report_reply(self, id: int, err: int, data: bytes):
         ev = struct.pack("< L L H H", UHID_GET_REPORT_REPLY, id, err, len(data)) + data
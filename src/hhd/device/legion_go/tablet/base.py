@@ -7,6 +7,7 @@ from typing import Sequence
 
 from hhd.controller import Button, Consumer, Event, Producer, DEBUG_MODE
 from hhd.controller.lib.hide import unhide_all
+from hhd.controller.lib.uevent import UeventMonitor
 from hhd.controller.base import Multiplexer, TouchpadAction
 from hhd.controller.physical.evdev import B as EC
 from hhd.controller.physical.evdev import GenericGamepadEvdev, enumerate_evs
@@ -28,6 +29,8 @@ ERROR_DELAY = 0.5
 LONGER_ERROR_DELAY = 3
 LONGER_ERROR_MARGIN = 1.3
 SELECT_TIMEOUT = 1
+# Fallback in case a uevent is missed
+WATCH_DELAY = 5
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +41,8 @@ LEN_PIDS = {
     0x6184: "dual_dinput",
     0x6185: "fps",
 }
+LEN_ALL_PIDS = tuple(LEN_PIDS)
+LEN_XINPUT_PID = 0x6182
 
 
 def plugin_run(
@@ -53,80 +58,103 @@ def plugin_run(
     init = time.perf_counter()
     repeated_fail = False
 
-    while not should_exit.is_set():
-        try:
-            controller_mode = None
-            pid = None
-            first = True
-            while not controller_mode and not should_exit.is_set():
-                devs = enumerate_evs(vid=LEN_VID)
-                if not devs:
-                    if first:
-                        first = False
-                        logger.warning(f"Legion go controllers not found, waiting...")
-                    time.sleep(FIND_DELAY)
-                    continue
+    # Block on uevents while the controllers are missing
+    monitor = UeventMonitor(settle=FIND_DELAY)
+    watching = monitor.open()
+    if watching:
+        find_delay = error_delay = WATCH_DELAY
+    else:
+        find_delay = FIND_DELAY
+        error_delay = ERROR_DELAY
 
-                for d in devs.values():
-                    if d.get("product", None) in LEN_PIDS:
-                        pid = d["product"]
-                        controller_mode = LEN_PIDS[pid]
-                        break
-                else:
-                    logger.error(
-                        f"Legion go controllers not found, waiting {ERROR_DELAY}s."
+    try:
+        while not should_exit.is_set():
+            try:
+                controller_mode = None
+                pid = None
+                first = True
+                while not controller_mode and not should_exit.is_set():
+                    devs = enumerate_evs(vid=LEN_VID)
+                    if not devs:
+                        if first:
+                            first = False
+                            logger.warning(
+                                f"Legion go controllers not found, waiting..."
+                            )
+                        monitor.wait(find_delay, should_exit)
+                        continue
+
+                    pid = next(
+                        (
+                            d["product"]
+                            for d in devs.values()
+                            if d.get("product", None) in LEN_PIDS
+                        ),
+                        None,
                     )
-                    time.sleep(ERROR_DELAY)
+                    if pid is None:
+                        if watching:
+                            logger.error(
+                                f"Legion go controllers not found, waiting for a mode change."
+                            )
+                        else:
+                            logger.error(
+                                f"Legion go controllers not found, waiting {error_delay}s."
+                            )
+                        monitor.wait(error_delay, should_exit)
+                        continue
+                    controller_mode = LEN_PIDS[pid]
+
+                if not controller_mode:
+                    # If should_exit was set controller_mode will be null
                     continue
 
-            if not controller_mode:
-                # If should_exit was set controller_mode will be null
-                continue
-
-            conf_copy = conf.copy()
-            updated.clear()
-            if (
-                controller_mode == "xinput"
-                and conf["xinput.mode"].to(str) != "disabled"
-            ):
-                logger.info("Launching emulated controller.")
-                init = time.perf_counter()
-                controller_loop_xinput(conf_copy, should_exit, updated, emit, reset)
-            else:
-                if controller_mode != "xinput":
-                    logger.info(
-                        f"Controllers in non-supported (yet) mode: {controller_mode}."
-                    )
+                conf_copy = conf.copy()
+                updated.clear()
+                if (
+                    controller_mode == "xinput"
+                    and conf["xinput.mode"].to(str) != "disabled"
+                ):
+                    logger.info("Launching emulated controller.")
+                    init = time.perf_counter()
+                    controller_loop_xinput(conf_copy, should_exit, updated, emit, reset)
                 else:
-                    logger.info(
-                        f"Controllers in xinput mode but emulation is disabled."
+                    if controller_mode != "xinput":
+                        logger.info(
+                            f"Controllers in non-supported (yet) mode: {controller_mode}."
+                        )
+                    else:
+                        logger.info(
+                            f"Controllers in xinput mode but emulation is disabled."
+                        )
+                    init = time.perf_counter()
+                    controller_loop_rest(
+                        controller_mode,
+                        pid if pid else 2,
+                        conf_copy,
+                        should_exit,
+                        updated,
+                        emit,
+                        reset,
                     )
-                init = time.perf_counter()
-                controller_loop_rest(
-                    controller_mode,
-                    pid if pid else 2,
-                    conf_copy,
-                    should_exit,
-                    updated,
-                    emit,
-                    reset,
+                repeated_fail = False
+            except Exception as e:
+                failed_fast = init + LONGER_ERROR_MARGIN > time.perf_counter()
+                sleep_time = (
+                    LONGER_ERROR_DELAY if repeated_fail and failed_fast else ERROR_DELAY
                 )
-            repeated_fail = False
-        except Exception as e:
-            failed_fast = init + LONGER_ERROR_MARGIN > time.perf_counter()
-            sleep_time = (
-                LONGER_ERROR_DELAY if repeated_fail and failed_fast else ERROR_DELAY
-            )
-            repeated_fail = failed_fast
-            logger.error(f"Received the following error:\n{type(e)}: {e}")
-            logger.error(
-                f"Assuming controllers disconnected, restarting after {sleep_time}s."
-            )
-            # Raise exception
-            if DEBUG_MODE:
-                raise e
-            time.sleep(sleep_time)
-        reset = False
+                repeated_fail = failed_fast
+                logger.error(f"Received the following error:\n{type(e)}: {e}")
+                logger.error(
+                    f"Assuming controllers disconnected, restarting after {sleep_time}s."
+                )
+                # Raise exception
+                if DEBUG_MODE:
+                    raise e
+                time.sleep(sleep_time)
+            reset = False
+    finally:
+        monitor.close()
 
     # Unhide all devices before exiting
     unhide_all()
@@ -151,7 +179,7 @@ def controller_loop_rest(
     d_raw = SelectivePassthrough(
         LegionHidraw(
             vid=[LEN_VID],
-            pid=list(LEN_PIDS),
+            pid=LEN_ALL_PIDS,
             usage_page=[0xFFA0],
             usage=[0x0001],
             report_size=64,
@@ -179,7 +207,7 @@ def controller_loop_rest(
 
     d_shortcuts = GenericGamepadEvdev(
         vid=[LEN_VID],
-        pid=list(LEN_PIDS),
+        pid=LEN_ALL_PIDS,
         name=[re.compile(r"Legion-Controller \d-.. Keyboard")],
         capabilities={EC("EV_KEY"): [EC("KEY_1")]},
         required=True,
@@ -252,16 +280,16 @@ def controller_loop_xinput(
 
     # Inputs
     d_xinput = GenericGamepadEvdev(
-        vid=[0x17EF],
-        pid=[0x6182],
+        vid=[LEN_VID],
+        pid=[LEN_XINPUT_PID],
         # name=["Generic X-Box pad"],
         capabilities={EC("EV_KEY"): [EC("BTN_A")]},
         required=True,
         hide=True,
     )
     d_touch = GenericGamepadEvdev(
-        vid=[0x17EF],
-        pid=[0x6182],
+        vid=[LEN_VID],
+        pid=[LEN_XINPUT_PID],
         name=[re.compile(".+Touchpad")],  # "  Legion Controller for Windows  Touchpad"
         capabilities={EC("EV_KEY"): [EC("BTN_MOUSE")]},
         btn_map=LGO_TOUCHPAD_BUTTON_MAP,
@@ -272,7 +300,7 @@ def controller_loop_xinput(
     d_raw = SelectivePassthrough(
         LegionHidraw(
             vid=[LEN_VID],
-            pid=list(LEN_PIDS),
+            pid=LEN_ALL_PIDS,
             usage_page=[0xFFA0],
             usage=[0x0001],
             report_size=64,
@@ -292,7 +320,7 @@ def controller_loop_xinput(
     # Mute keyboard shortcuts, mute
     d_shortcuts = GenericGamepadEvdev(
         vid=[LEN_VID],
-        pid=list(LEN_PIDS),
+        pid=LEN_ALL_PIDS,
         name=[re.compile(".+Keyboard")],  # "  Legion Controller for Windows  Keyboard"
         # capabilities={EC("EV_KEY"): [EC("KEY_1")]},
         # report_size=64,
@@ -325,18 +353,20 @@ def controller_loop_xinput(
     REPORT_FREQ_MAX = 500
 
     REPORT_DELAY_MAX = 1 / REPORT_FREQ_MIN
-    REPORT_DELAY_MIN = 1 / REPORT_FREQ_MAX
+    REPORT_DELAY_MIN_NS = 1_000_000_000 // REPORT_FREQ_MAX
 
     fds = []
     devs = []
-    fd_to_dev = {}
+    d_fds = []
+    ep = select.epoll()
 
     def prepare(m):
         devs.append(m)
         fs = m.open()
+        d_fds.append(fs)
         fds.extend(fs)
         for f in fs:
-            fd_to_dev[f] = m
+            ep.register(f, select.EPOLLIN)
 
     try:
         prepare(d_xinput)
@@ -347,22 +377,38 @@ def controller_loop_xinput(
         for d in d_producers:
             prepare(d)
 
+        # Device index for each fd
+        fd_to_devidx = [-1] * (max(fds, default=0) + 1)
+        for i, fs in enumerate(d_fds):
+            for f in fs:
+                fd_to_devidx[f] = i
+
         ts_count: dict[str, int] = {"left_imu_ts": 0, "right_imu_ts": 0}
         ts_last: dict[str, int] = {"left_imu_ts": 0, "right_imu_ts": 0}
 
+        dev_produce = [d.produce for d in devs]
+        outs_consume = [d.consume for d in d_outs]
+        log_evs = logger.info if debug else lambda _: None
+
+        # Reused between reports to avoid allocations
+        evs_buf: list[Event] = []
+        # Ready fds per device, each producer only receives its own
+        dev_ready: list[list[int]] = [[] for _ in devs]
+
         logger.info("Emulated controller launched, have fun!")
         while not should_exit.is_set() and not updated.is_set():
-            start = time.perf_counter()
+            start = time.perf_counter_ns()
             # Add timeout to call consumers a minimum amount of times per second
-            r, _, _ = select.select(fds, [], [], REPORT_DELAY_MAX)
-            evs = []
-            to_run = set()
-            for f in r:
-                to_run.add(id(fd_to_dev[f]))
+            for f, _ in ep.poll(REPORT_DELAY_MAX):
+                dev_ready[fd_to_devidx[f]].append(f)
 
-            for d in devs:
-                if id(d) in to_run:
-                    evs.extend(d.produce(r))
+            evs = evs_buf
+            evs.clear()
+            for i, produce in enumerate(dev_produce):
+                r = dev_ready[i]
+                if r:
+                    evs.extend(produce(r))
+                    r.clear()
 
             # Patch timestamps to convert them to ns
             # for d in ('x', 'y', 'z'):
@@ -377,18 +423,21 @@ def controller_loop_xinput(
             #         print(f"{d}:              ", end='')
             # print()
             for ev in evs:
-                if ev["type"] == "axis" and "_imu_ts" in ev["code"]:
+                if ev["type"] != "axis":
+                    continue
+                code = ev["code"]
+                if code in ts_last:
                     # Find diff between previous event
-                    last = ts_last[ev["code"]]
+                    last = ts_last[code]
                     curr = ev["value"]
                     diff = curr - last
                     if curr < last:
                         diff += 256
-                    ts_last[ev["code"]] = curr
+                    ts_last[code] = curr
                     # 8ms per count
-                    ts_count[ev["code"]] += diff * 8_000_000
-                    ev["value"] = ts_count[ev["code"]]
-                if ev["type"] == "axis" and "gyro" in ev["code"]:
+                    ts_count[code] += diff * 8_000_000
+                    ev["value"] = ts_count[code]
+                elif "gyro" in code:
                     v = ev["value"]
                     if (abs(v / 0.001065) // 1) in (254, 255):
                         # Legion go controllers have a bug where they will
@@ -397,30 +446,33 @@ def controller_loop_xinput(
 
             evs = multiplexer.process(evs)
             if evs:
-                if debug:
-                    logger.info(evs)
+                log_evs(evs)
 
                 d_xinput.consume(evs)
                 d_raw.consume(evs)
 
-            for d in d_outs:
-                d.consume(evs)
+            for consume in outs_consume:
+                consume(evs)
 
-            t = time.perf_counter()
-            elapsed = t - start
-            if elapsed < REPORT_DELAY_MIN:
-                time.sleep(REPORT_DELAY_MIN - elapsed)
+            elapsed = time.perf_counter_ns() - start
+            if elapsed < REPORT_DELAY_MIN_NS:
+                time.sleep((REPORT_DELAY_MIN_NS - elapsed) / 1e9)
 
     except KeyboardInterrupt:
         raise
     finally:
-        for d in reversed(devs):
-            try:
-                d.close(not updated.is_set())
-            except Exception as e:
-                logger.error(f"Error while closing device '{d}' with exception:\n{e}")
-                if debug:
-                    raise e
+        try:
+            for d in reversed(devs):
+                try:
+                    d.close(not updated.is_set())
+                except Exception as e:
+                    logger.error(
+                        f"Error while closing device '{d}' with exception:\n{e}"
+                    )
+                    if debug:
+                        raise e
+        finally:
+            ep.close()
 
 
 class SelectivePassthrough(Producer, Consumer):
@@ -437,15 +489,20 @@ class SelectivePassthrough(Producer, Consumer):
         self.parent = parent
         self.state = False
 
-        self.forward_buttons = forward_buttons
-        self.passthrough = passthrough
+        self.forward_buttons = frozenset(forward_buttons)
+        self.passthrough = frozenset(passthrough)
         self.pressed_time = None
         self.pressed_vals = set()
         self.passthrough_pressed = passthrough_pressed
 
-        self.to_disable_btn = set()
+        self.to_disable_btn: set[Button] = set()
         self.to_disable_axis = set()
 
+        self._out: list[Event] = []
+        # Whether to forward a code is decided once per code
+        self._keep_btn: dict[str, bool] = {}
+        self._keep_axis: dict[str, bool] = {}
+
     def open(self) -> Sequence[int]:
         return self.parent.open()
 
@@ -455,31 +512,57 @@ class SelectivePassthrough(Producer, Consumer):
     def produce(self, fds: Sequence[int]) -> Sequence[Event]:
         evs: Sequence[Event] = self.parent.produce(fds)
 
-        out = []
+        # Callers copy the events out, so the list can be reused.
+        # Clear it first to drop references to the previous report.
+        out = self._out
+        out.clear()
         curr = time.perf_counter()
         if self.passthrough_pressed:
             passthrough = bool(self.pressed_vals)
         else:
             passthrough = self.pressed_time and (curr - self.pressed_time < 1)
 
+        fwd = self.forward_buttons
+        keep_btn = self._keep_btn
+        keep_axis = self._keep_axis
+        out_append = out.append
         for ev in evs:
-            if ev["type"] == "button" and ev["code"] in self.forward_buttons:
-                if ev.get("value", False):
-                    self.pressed_time = curr
-                    self.pressed_vals.add(ev["code"])
-                else:
-                    self.pressed_vals.discard(ev["code"])
-
-            if ev["type"] == "configuration":
-                out.append(ev)
-            elif ev["type"] == "button" and ev["code"] in self.passthrough:
-                out.append(ev)
-            elif ev["type"] == "axis" and (
-                "imu" in ev["code"] or "accel" in ev["code"] or "gyro" in ev["code"]
-            ):
-                out.append(ev)
-            elif "touchpad" in ev["code"]:
-                out.append(ev)
+            etype = ev["type"]
+            if etype == "configuration":
+                out_append(ev)
+                continue
+
+            code = ev["code"]
+            if etype == "button":
+                if code in fwd:
+                    if ev.get("value", False):
+                        self.pressed_time = curr
+                        self.pressed_vals.add(code)
+                    else:
+                        self.pressed_vals.discard(code)
+
+                keep = keep_btn.get(code)
+                if keep is None:
+                    keep = code in self.passthrough or "touchpad" in code
+                    keep_btn[code] = keep
+
+                if keep:
+                    out_append(ev)
+            elif etype == "axis":
+                keep = keep_axis.get(code)
+                if keep is None:
+                    keep = (
+                        "imu" in code
+                        or "accel" in code
+                        or "gyro" in code
+                        or "touchpad" in code
+                    )
+                    keep_axis[code] = keep
+
+                if keep:
+                    out_append(ev)
+            elif "touchpad" in code:
+                out_append(ev)
 
         if passthrough:
             # If mode is pressed, forward all events